@@ -18,16 +18,37 @@ New config keys under [QRCODE]:
 
 from __future__ import annotations
 
+try:
+    import segno
+except ImportError:
+    segno = None
+
 try:
     import qrcode
 except ImportError:
     qrcode = None
 
 import os
+import atexit
 import logging
+import functools
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import png  # pypng, installed with qrcode>=7.4
+except ImportError:
+    png = None
 
 import pygame
 import pibooth
+from pibooth import fonts
+from PIL import Image
 from pibooth.view.background import multiline_text_to_surfaces
 
 __version__ = '1.0.5'
@@ -35,9 +56,21 @@ __version__ = '1.0.5'
 SECTION = 'QRCODE'
 LOCATIONS = ['topleft', 'topright', 'bottomleft', 'bottomright',
              'midtop-left', 'midtop-right', 'midbottom-left', 'midbottom-right']
+QR_BOX_SIZE = 3  # Pixels per module
+QR_BORDER = 1  # Modules
+
+# Constant arguments of qrcode.QRCode(), resolved once
+_QR_KWARGS = dict(version=1, box_size=QR_BOX_SIZE, border=QR_BORDER,
+                  error_correction=qrcode.constants.ERROR_CORRECT_L if qrcode else None)
 
 logger = logging.getLogger(__name__)
 
+_save_executor = ThreadPoolExecutor(max_workers=1)
+atexit.register(_save_executor.shutdown, wait=True)  # In case pibooth_cleanup is not called
+
+_layout_cache = OrderedDict()  # Small LRU, see _get_qr_layout()
+_LAYOUT_CACHE_SIZE = 4
+
 
 @pibooth.hookimpl
 def pibooth_configure(cfg):
@@ -62,46 +95,117 @@ def pibooth_configure(cfg):
     cfg.add_option(SECTION, 'save_path', "", "Optional directory to save QR images (overrides GENERAL.directory)", None, "")
 
 
+def _parse_location(location):
+    """Return the tuple (rect attribute, y sign, x sign, is mid, sublocation is left)."""
+    attr, _, sublocation = location.partition('-')
+    return (attr, 1 if 'top' in attr else -1, 1 if 'left' in attr else -1,
+            'mid' in attr, 'left' in sublocation)
+
+
+_LOCATIONS_PARSED = {location: _parse_location(location) for location in LOCATIONS}
+
+
 def get_qrcode_rect(win_rect, qrcode_image, location, offset):
-    sublocation = ''
-    if '-' in location:
-        location, sublocation = location.split('-')
-    pos = list(getattr(win_rect, location))
-    if 'top' in location:
-        pos[1] += offset[1]
-    else:
-        pos[1] -= offset[1]
-    if 'left' in location:
-        pos[0] += offset[0]
-    else:
-        pos[0] -= offset[0]
-    if 'mid' in location:
-        if 'left' in sublocation:
-            pos[0] -= qrcode_image.get_size()[0] // 2
+    attr, y_sign, x_sign, is_mid, sub_left = _LOCATIONS_PARSED[location]
+    x, y = getattr(win_rect, attr)
+    x += x_sign * offset[0]
+    y += y_sign * offset[1]
+    if is_mid:
+        if sub_left:
+            x -= qrcode_image.get_width() // 2
         else:
-            pos[0] += (qrcode_image.get_size()[0] // 2 + 2 * offset[0])
-    qr_rect = qrcode_image.get_rect(**{location: pos})
-    return qr_rect
+            x += qrcode_image.get_width() // 2 + 2 * offset[0]
+    return qrcode_image.get_rect(**{attr: (x, y)})
 
 
 def get_text_rect(win_rect, qrcode_rect, location, margin=10):
+    _, _, x_sign, is_mid, sub_left = _LOCATIONS_PARSED[location]
     text_rect = pygame.Rect(0, 0, win_rect.width // 6, qrcode_rect.height)
-    sublocation = ''
-    if '-' in location:
-        location, sublocation = location.split('-')
     text_rect.top = qrcode_rect.top
-    if 'left' in location:
-        text_rect.left = qrcode_rect.right + margin
-    else:
+    if sub_left if is_mid else x_sign < 0:
         text_rect.right = qrcode_rect.left - margin
-    if 'mid' in location:
-        if 'left' in sublocation:
-            text_rect.right = qrcode_rect.left - margin
-        else:
-            text_rect.left = qrcode_rect.right + margin
+    else:
+        text_rect.left = qrcode_rect.right + margin
     return text_rect
 
 
+def _make_qr_matrix(qr_text):
+    """Encode the text and return the QR Code modules matrix (border included).
+
+    The faster segno encoder is used if it is installed, else qrcode.
+    """
+    if segno is not None:
+        qr = segno.make_qr(qr_text, error='l', boost_error=False)
+        return [list(row) for row in qr.matrix_iter(scale=1, border=QR_BORDER)]
+
+    qr = qrcode.QRCode(**_QR_KWARGS)
+    qr.add_data(qr_text)
+    qr.make(fit=True)
+    return qr.get_matrix()
+
+
+@functools.lru_cache(maxsize=16)
+def _build_qr(qr_text, fill_color, background_color):
+    """Return the RGB pixels (read-only memoryview) and the (width, height)
+    of the QR Code.
+
+    Results are memoized: the same URL (retry, reprint, ...) is not encoded
+    twice. The pixels are shared by the cache, the pygame surface and the
+    save thread, hence read-only.
+    """
+    return _render_qr_pixels(_make_qr_matrix(qr_text), fill_color, background_color, QR_BOX_SIZE)
+
+
+def _render_qr_pixels(matrix, fill_color, background_color, box_size):
+    """Rasterize the QR Code modules matrix (border included) to RGB pixels.
+
+    Return the pixels as a read-only memoryview and the (width, height) of
+    the image.
+    """
+    if np is not None:
+        modules = np.asarray(matrix, dtype=np.bool_)
+        rows, cols = modules.shape
+        # Fill the final buffer in place through a (row, box, col, box, RGB) view:
+        # no upscaled intermediate array and no tobytes() copy
+        buffer = bytearray(rows * box_size * cols * box_size * 3)
+        pixels = np.frombuffer(buffer, dtype=np.uint8).reshape(rows, box_size, cols, box_size, 3)
+        pixels[...] = background_color
+        np.copyto(pixels, np.array(fill_color, dtype=np.uint8), where=modules[:, None, :, None, None])
+        return memoryview(buffer).toreadonly(), (cols * box_size, rows * box_size)
+
+    # Pure Python fallback: build each pixels row once and repeat it
+    fill = bytes(fill_color) * box_size
+    background = bytes(background_color) * box_size
+    rows = [b''.join(fill if module else background for module in line) * box_size for line in matrix]
+    return memoryview(b''.join(rows)), (len(matrix[0]) * box_size, len(matrix) * box_size)
+
+
+def _get_qr_layout(win_rect, qrcode_image, location, offset, side_text, text_color):
+    """Return the QR Code rect and the side text (surface, rect) pairs.
+
+    The last results are cached because they only change when the window is
+    resized or when the configuration is edited. The cache is keyed on the QR
+    size (not the surface), so it is bounded by hand instead of using
+    functools.lru_cache.
+    """
+    # The side text is rendered with the current font, which can be edited from the settings menu
+    key = (tuple(win_rect), qrcode_image.get_size(), location, tuple(offset), side_text, tuple(text_color),
+           fonts.CURRENT)
+    layout = _layout_cache.get(key)
+    if layout is None:
+        qrcode_rect = get_qrcode_rect(win_rect, qrcode_image, location, offset)
+        texts = []
+        if side_text:
+            text_rect = get_text_rect(win_rect, qrcode_rect, location)
+            texts = multiline_text_to_surfaces(side_text, text_color, text_rect, 'bottom-left')
+        layout = _layout_cache[key] = (qrcode_rect, texts)
+        if len(_layout_cache) > _LAYOUT_CACHE_SIZE:
+            _layout_cache.popitem(last=False)
+    else:
+        _layout_cache.move_to_end(key)
+    return layout
+
+
 @pibooth.hookimpl
 def pibooth_startup(cfg):
     """Check the coherence of options."""
@@ -111,7 +215,7 @@ def pibooth_startup(cfg):
                 state, cfg.get(SECTION, '{}_location'.format(state))))
 
 
-def _determine_save_directory(cfg, picture_filename):
+def _determine_save_directory(cfg, save_path, picture_filename):
     """
     Determine where to save QR images:
     - If QRCODE.save_path is set (non-empty), use it (interpreted as absolute or relative path).
@@ -119,43 +223,78 @@ def _determine_save_directory(cfg, picture_filename):
     - If neither is available, fall back to the directory of the picture_filename.
     Returns an absolute path.
     """
-    # 1) explicit QRCODE.save_path
-    save_path = cfg.get(SECTION, 'save_path') or ""
-    if save_path:
-        save_dir = os.path.expanduser(save_path)
-    else:
-        # 2) GENERAL.directory
+    general_dir = ""
+    if not save_path:
         try:
             general_dir = cfg.get('GENERAL', 'directory')
         except Exception:
             general_dir = ""
-        if general_dir:
-            save_dir = os.path.expanduser(general_dir)
-        else:
-            # 3) fallback to picture file directory
-            if picture_filename:
-                save_dir = os.path.dirname(os.path.abspath(picture_filename))
-            else:
-                save_dir = os.getcwd()
-    # Ensure absolute path
-    if not os.path.isabs(save_dir):
-        save_dir = os.path.abspath(save_dir)
-    return save_dir
+    return _resolve_save_directory(save_path or "", general_dir or "",
+                                   os.path.dirname(picture_filename or ""))
+
+
+@functools.lru_cache(maxsize=8)
+def _resolve_save_directory(save_path, general_dir, picture_dir):
+    """Return the absolute save directory (memoized, as the options rarely
+    change between captures).
+    """
+    if save_path or general_dir:
+        return os.path.abspath(os.path.expanduser(save_path or general_dir))
+    # Fallback to picture file directory (current directory if empty)
+    return os.path.abspath(picture_dir)
+
+
+def _save_qr_image(image, qr_path, ext):
+    """Save the QR image to the given path (may run in the save executor thread).
+
+    Return True if the file is written.
+    """
+    # A QR Code bitmap is barely smaller at the default zlib level, so use
+    # the fastest one for PNG
+    if ext.lower() == "png":
+        params = {'format': "PNG", 'compress_level': 1, 'optimize': False}
+    else:
+        params = {}
+    try:
+        image.save(qr_path, **params)
+        logger.info("pibooth-qrcode: saved QR image to %s", qr_path)
+        return True
+    except Exception as e:
+        logger.exception("pibooth-qrcode: failed saving QR image to %s: %s", qr_path, e)
+        return False
+
+
+def _write_qr_png(pixels, size, qr_path):
+    """Write the QR RGB pixels to a PNG file using pypng, without any Pillow
+    image (may run in the save executor thread).
+
+    Return True if the file is written.
+    """
+    width, height = size
+    stride = width * 3
+    rows = (memoryview(pixels)[i:i + stride] for i in range(0, stride * height, stride))
+    try:
+        with open(qr_path, 'wb') as fp:
+            png.Writer(width, height, greyscale=False, compression=1).write(fp, rows)
+        logger.info("pibooth-qrcode: saved QR image to %s", qr_path)
+        return True
+    except Exception as e:
+        logger.exception("pibooth-qrcode: failed saving QR image to %s: %s", qr_path, e)
+        return False
 
 
 @pibooth.hookimpl(trylast=True)
-def state_processing_do(cfg, app):
+def state_processing_do(cfg, app, win):
     """
     Run during processing loop (state_processing_do).
     Generate the QR Code, store it in the application and optionally save it to the configured directory.
     """
-    if qrcode is None:
+    if qrcode is None and segno is None:
         raise ModuleNotFoundError("No module named 'qrcode'")
 
     try:
-        # build QR code
-        qr = qrcode.QRCode(version=1, error_correction=qrcode.constants.ERROR_CORRECT_L,
-                           box_size=3, border=1)
+        # Read the options once, the configuration parser is slow
+        opts = {key: cfg.get(SECTION, key) for key in ('prefix_url', 'save', 'suffix', 'ext', 'save_path')}
 
         url_vars = {
             'picture': app.picture_filename,
@@ -163,28 +302,20 @@ def state_processing_do(cfg, app):
             'url': getattr(app, 'previous_picture_url', None) or ''
         }
 
-        qr_text = cfg.get(SECTION, 'prefix_url').format(**url_vars)
-        qr.add_data(qr_text)
-        qr.make(fit=True)
+        qr_text = opts['prefix_url'].format(**url_vars)
 
-        qrcode_fill_color = '#%02x%02x%02x' % cfg.gettyped("QRCODE", 'foreground')
-        qrcode_background_color = '#%02x%02x%02x' % cfg.gettyped("QRCODE", 'background')
-        image = qr.make_image(fill_color=qrcode_fill_color, back_color=qrcode_background_color)
+        # Colors are read on each capture as they can be edited from the settings menu
+        pixels, size = _build_qr(qr_text, tuple(cfg.gettyped(SECTION, 'foreground')),
+                                 tuple(cfg.gettyped(SECTION, 'background')))
 
-        # Keep the pygame-compatible surface for display
-        try:
-            app.previous_qr = pygame.image.fromstring(image.tobytes(), image.size, image.mode)
-        except Exception:
-            # Fallback if direct conversion fails: create a pygame surface via conversion
-            pil_mode = image.mode
-            if pil_mode not in ('RGB', 'RGBA'):
-                image = image.convert('RGBA')
-            string = image.tobytes()
-            app.previous_qr = pygame.image.fromstring(string, image.size, 'RGBA')
+        # Keep the pygame-compatible surface for display. The surface wraps the
+        # pixel bytes without copying them, then it is converted once to the
+        # display pixel format so that the frequent redraws done in state_wait_do
+        # do not have to convert it on each blit.
+        app.previous_qr = pygame.image.frombuffer(pixels, size, 'RGB').convert(win.surface)
 
         # Optional: save the QR image to configured directory
-        save_enabled = cfg.get(SECTION, 'save')
-        if save_enabled:
+        if opts['save']:
             picture_filename = app.picture_filename
             # Prepare basename for saved file. Use picture basename if available, otherwise a count-based name.
             if picture_filename:
@@ -192,9 +323,9 @@ def state_processing_do(cfg, app):
             else:
                 base_name = f"picture_{getattr(app, 'count', '0')}"
 
-            suffix = cfg.get(SECTION, 'suffix') or "_qrcode"
-            ext = (cfg.get(SECTION, 'ext') or "png").lstrip('.')
-            save_dir = _determine_save_directory(cfg, picture_filename)
+            suffix = opts['suffix'] or "_qrcode"
+            ext = (opts['ext'] or "png").lstrip('.')
+            save_dir = _determine_save_directory(cfg, opts['save_path'], picture_filename)
 
             # Ensure directory exists
             try:
@@ -206,40 +337,26 @@ def state_processing_do(cfg, app):
             qr_path = os.path.join(save_dir, qr_filename)
 
             try:
-                img_to_save = image
-
-                # Normalize Pillow image modes for requested extension
-                ext_l = ext.lower()
-                if hasattr(img_to_save, "mode"):
-                    mode = img_to_save.mode
-                    if mode == "P":
-                        img_to_save = img_to_save.convert("RGBA")
-                    if mode == "RGBA" and ext_l in ("jpg", "jpeg"):
-                        img_to_save = img_to_save.convert("RGB")
-                    elif mode not in ("RGB", "RGBA") and ext_l in ("png", "jpg", "jpeg"):
-                        img_to_save = img_to_save.convert("RGB")
-
-                # Save file
-                try:
-                    img_to_save.save(qr_path)
-                    logger.info("pibooth-qrcode: saved QR image to %s", qr_path)
-                except Exception:
-                    # Try converting to RGBA then saving as fallback
-                    try:
-                        img2 = image.convert("RGBA")
-                        img2.save(qr_path)
-                        logger.info("pibooth-qrcode: saved QR image to %s (via RGBA fallback)", qr_path)
-                    except Exception as e:
-                        logger.exception("pibooth-qrcode: failed saving QR image to %s: %s", qr_path, e)
-
-                # Optionally attach saved path into app metadata if present
-                try:
-                    if hasattr(app, "picture_metadata") and isinstance(app.picture_metadata, dict) and picture_filename:
-                        abs_picture = os.path.abspath(picture_filename)
-                        app.picture_metadata.setdefault(abs_picture, {})["qrcode_path"] = os.path.abspath(qr_path)
-                except Exception:
-                    # Don't let metadata attach failures break flow
-                    pass
+                if ext.lower() == "png" and png is not None:
+                    save, args = _write_qr_png, (pixels, size, qr_path)
+                else:
+                    save, args = _save_qr_image, (Image.frombytes('RGB', size, pixels), qr_path, ext)
+
+                metadata = getattr(app, "picture_metadata", None)
+                if isinstance(metadata, dict) and picture_filename:
+                    # Other plugins (e.g. pibooth-gallery) read the saved path from the
+                    # picture metadata: the file shall be on disk before leaving this hook
+                    if save(*args):
+                        try:
+                            abs_picture = os.path.abspath(picture_filename)
+                            metadata.setdefault(abs_picture, {})["qrcode_path"] = os.path.abspath(qr_path)
+                        except Exception:
+                            # Don't let metadata attach failures break flow
+                            pass
+                else:
+                    # Nobody waits for the file: encode it in a background thread to
+                    # not block the state machine
+                    _save_executor.submit(save, *args)
 
             except Exception as e:
                 logger.exception("pibooth-qrcode: unexpected error while saving QR image: %s", e)
@@ -248,6 +365,12 @@ def state_processing_do(cfg, app):
         logger.exception("pibooth-qrcode: error while generating or saving QR image")
 
 
+@pibooth.hookimpl
+def pibooth_cleanup():
+    """Wait for the QR images still being saved."""
+    _save_executor.shutdown(wait=True)
+
+
 @pibooth.hookimpl
 def state_wait_enter(cfg, app, win):
     """Display the QR Code on the wait view."""
@@ -255,25 +378,27 @@ def state_wait_enter(cfg, app, win):
     location = cfg.get(SECTION, 'wait_location')
     if hasattr(app, 'previous_qr') and app.previous_picture:
         offset = cfg.gettuple(SECTION, 'offset', int, 2)
-        app.qr_rect = get_qrcode_rect(win_rect, app.previous_qr, location, offset)
-        win.surface.blit(app.previous_qr, app.qr_rect.topleft)
-        if cfg.get(SECTION, 'side_text'):
-            text_rect = get_text_rect(win_rect, app.qr_rect, location)
-            app.qr_texts = multiline_text_to_surfaces(cfg.get(SECTION, 'side_text'),
-                                                      cfg.gettyped('WINDOW', 'text_color'),
-                                                      text_rect, 'bottom-left')
-            for text, rect in app.qr_texts:
-                win.surface.blit(text, rect)
+        app.qr_rect, app.qr_texts = _get_qr_layout(win_rect, app.previous_qr, location, offset,
+                                                   cfg.get(SECTION, 'side_text'),
+                                                   cfg.gettyped('WINDOW', 'text_color'))
+        # QR Code and side text are drawn in a single C call
+        app.qr_blits = [(app.previous_qr, app.qr_rect.topleft)] + list(app.qr_texts)
+        win.surface.blits(app.qr_blits, doreturn=False)
+        # The wait view may be drawn after this hook, redraw on next loop
+        app.qr_needs_redraw = True
 
 
-@pibooth.hookimpl
-def state_wait_do(app, win):
-    """Redraw the QR Code because it may have been erased by a screen update (for instance, if a print is done)."""
+@pibooth.hookimpl(trylast=True)
+def state_wait_do(app, win, events):
+    """Redraw the QR Code because it may have been erased by a screen update (for instance, if a print is done).
+
+    The view is only updated on events or when the previous picture is animated,
+    so the QR Code is not redrawn on idle loops.
+    """
     if hasattr(app, 'previous_qr') and app.previous_picture:  # Not displayed if no previous capture is deleted
-        win.surface.blit(app.previous_qr, app.qr_rect.topleft)
-        if hasattr(app, 'qr_texts'):
-            for text, rect in app.qr_texts:
-                win.surface.blit(text, rect)
+        if getattr(app, 'qr_needs_redraw', True) or events or getattr(app, 'previous_animated', None):
+            win.surface.blits(app.qr_blits, doreturn=False)
+            app.qr_needs_redraw = False
 
 
 @pibooth.hookimpl
@@ -282,14 +407,7 @@ def state_print_enter(cfg, app, win):
     win_rect = win.get_rect()
     offset = cfg.gettuple(SECTION, 'offset', int, 2)
     location = cfg.get(SECTION, 'print_location')
-    qrcode_rect = get_qrcode_rect(win_rect, app.previous_qr, location, offset)
-
-    if cfg.get(SECTION, 'side_text'):
-        text_rect = get_text_rect(win_rect, qrcode_rect, location)
-        texts = multiline_text_to_surfaces(cfg.get(SECTION, 'side_text'),
-                                           cfg.gettyped('WINDOW', 'text_color'),
-                                           text_rect, 'bottom-left')
-        for text, rect in texts:
-            win.surface.blit(text, rect)
-
-    win.surface.blit(app.previous_qr, qrcode_rect.topleft)
+    qrcode_rect, texts = _get_qr_layout(win_rect, app.previous_qr, location, offset,
+                                        cfg.get(SECTION, 'side_text'),
+                                        cfg.gettyped('WINDOW', 'text_color'))
+    win.surface.blits(list(texts) + [(app.previous_qr, qrcode_rect.topleft)], doreturn=False)
@@ -50,6 +50,9 @@ def main():
             'pibooth>=2.0.0',
             'qrcode>=6.1'
         ],
+        extras_require={
+            'segno': ['segno>=1.0']
+        },
         zip_safe=False,  # Don't install the lib as an .egg zipfile
         entry_points={'pibooth': ["pibooth_qrcode = pibooth_qrcode"]},
     )